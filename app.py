@@ -1,10 +1,18 @@
 import streamlit as st
-import anthropic
 import json
-import re
-from typing import Dict, Optional
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
 import base64
+import hashlib
 from io import BytesIO
+from PIL import Image, ImageOps
+
+try:
+    import orjson
+except ImportError:  # optional speed-up; fall back to the stdlib serializer
+    orjson = None
+
+if TYPE_CHECKING:
+    import anthropic
 
 # Page configuration
 st.set_page_config(
@@ -15,7 +23,7 @@ st.set_page_config(
 )
 
 # Custom CSS
-st.markdown("""
+CUSTOM_CSS = """
     <style>
     .main-header {
         font-size: 2.5rem;
@@ -50,7 +58,7 @@ st.markdown("""
         font-style: italic;
     }
     </style>
-""", unsafe_allow_html=True)
+"""
 
 # Initialize session state
 if 'abg_values' not in st.session_state:
@@ -73,62 +81,47 @@ NORMAL_RANGES = {
     'albumin': (35, 50)
 }
 
-def extract_values_from_text(text: str, api_key: str) -> Dict:
-    """Use Claude API to extract ABG values from text/image"""
-    try:
-        client = anthropic.Anthropic(api_key=api_key)
-        
-        prompt = f"""Extract all arterial blood gas (ABG) values from this report. 
-        Look for: pH, pCO2, pO2, HCO3/bicarbonate, base excess, Na, Cl, K, albumin.
-        
-        Report text:
-        {text}
-        
-        Return ONLY a JSON object with the values found. Use null for missing values.
-        Example format:
-        {{
-            "pH": 7.35,
-            "pCO2": 5.5,
-            "pO2": 12.0,
-            "HCO3": 24,
-            "base_excess": -1,
-            "Na": 140,
-            "Cl": 102,
-            "K": 4.0,
-            "albumin": 40
-        }}
-        
-        Note: pCO2 and pO2 should be in kPa (not mmHg). If values are in mmHg, convert them (divide by 7.5).
-        Return only the JSON, no other text."""
-        
-        message = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=1000,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        
-        response_text = message.content[0].text
-        # Extract JSON from response
-        json_match = re.search(r'\{[^}]+\}', response_text, re.DOTALL)
-        if json_match:
-            return json.loads(json_match.group())
-        return {}
-    except Exception as e:
-        st.error(f"Error extracting values: {str(e)}")
-        return {}
+# Models: a fast, cheap tier for number extraction and Sonnet for the teaching analysis
+EXTRACTION_MODEL = "claude-haiku-4-5-20251001"
+ANALYSIS_MODEL = "claude-sonnet-4-20250514"
 
-def analyze_abg(values: Dict, clinical_info: str, api_key: str) -> str:
-    """Use Claude API to perform step-by-step ABG analysis"""
-    try:
-        client = anthropic.Anthropic(api_key=api_key)
-        
-        prompt = f"""You are a medical educator teaching ABG interpretation. Analyze this ABG step-by-step following the standard 5-step approach.
+# Output budgets: the extraction tool call is well under 100 tokens, so a tight cap bounds runaway output
+EXTRACTION_MAX_TOKENS = 200
+ANALYSIS_MAX_TOKENS = 2000
+# The fused upload call JSON-escapes the analysis inside a tool argument alongside the values, so it needs more room
+UPLOAD_ANALYSIS_MAX_TOKENS = 3000
 
-ABG Values:
-{json.dumps(values, indent=2)}
+# Structured-output tool for value extraction; Claude fills in the schema directly
+EXTRACTION_TOOLS = [{
+    "name": "extract_abg_values",
+    "description": "Record the ABG values found in a report. Use null for values that are not present. pCO2 and pO2 must be in kPa.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            key: {"type": ["number", "null"]} for key in NORMAL_RANGES
+        },
+        "required": list(NORMAL_RANGES)
+    }
+}]
+EXTRACTION_TOOL_CHOICE = {"type": "tool", "name": "extract_abg_values"}
 
-Clinical Information:
-{clinical_info if clinical_info else "Not provided"}
+# Upload flow: the same fields plus the written analysis, so one call does both
+UPLOAD_ANALYSIS_TOOLS = [{
+    "name": "record_abg_analysis",
+    "description": "Record the ABG values read from a report together with the step-by-step analysis in markdown. Use null for values that are not present. pCO2 and pO2 must be in kPa.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            **EXTRACTION_TOOLS[0]["input_schema"]["properties"],
+            "analysis": {"type": "string"}
+        },
+        "required": list(NORMAL_RANGES) + ["analysis"]
+    }
+}]
+UPLOAD_ANALYSIS_TOOL_CHOICE = {"type": "tool", "name": "record_abg_analysis"}
+
+# Static analysis instructions, sent as a cacheable prompt prefix
+ANALYSIS_INSTRUCTIONS = """You are a medical educator teaching ABG interpretation. Analyze the ABG below step-by-step following the standard 5-step approach.
 
 Perform a detailed step-by-step analysis following this structure:
 
@@ -164,17 +157,324 @@ Perform a detailed step-by-step analysis following this structure:
 
 Use clear, educational language suitable for medical trainees. Be thorough but concise."""
 
-        message = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=2000,
-            messages=[{"role": "user", "content": prompt}]
-        )
+def dumps_pretty(obj) -> str:
+    """Pretty-print obj as JSON with 2-space indentation, using orjson when available"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+    return json.dumps(obj, indent=2)
+
+@st.cache_resource
+def get_client(api_key: str) -> "anthropic.Anthropic":
+    """Create one Claude API client per key and reuse its connection pool across reruns"""
+    # Imported lazily so reruns without an API key don't pay for loading the SDK
+    import anthropic
+    return anthropic.Anthropic(
+        api_key=api_key,
+        default_headers={"anthropic-beta": "prompt-caching-2024-07-31"}
+    )
+
+def sniff_mime(data: bytes, fallback: str) -> str:
+    """Detect PNG, JPEG or PDF from the file's magic bytes, falling back to the browser-reported type"""
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:4] == b"%PDF":
+        return "application/pdf"
+    return fallback
+
+def prepare_image(bytes_data: bytes) -> Tuple[bytes, str]:
+    """Downscale an upload to Claude's 1568 px working size and re-encode it as JPEG"""
+    img = ImageOps.exif_transpose(Image.open(BytesIO(bytes_data)))
+    img.thumbnail((1568, 1568))
+    # JPEG has no alpha; flatten transparent pixels onto white so dark text stays readable
+    if img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        img = background
+    buf = BytesIO()
+    img.convert("RGB").save(buf, format="JPEG", quality=85, optimize=True)
+    return buf.getvalue(), "image/jpeg"
+
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=32)
+def encode_image(bytes_data: bytes) -> Tuple[str, str, str]:
+    """Downscale and base64-encode an upload once; returns (base64 data, media type, SHA-1 of the upload)"""
+    image_bytes, media_type = prepare_image(bytes_data)
+    return base64.b64encode(image_bytes).decode(), media_type, hashlib.sha1(bytes_data).hexdigest()
+
+def tool_input(message) -> Dict:
+    """Return the non-null arguments of the first tool_use block in a Claude response"""
+    block = next((b for b in message.content if b.type == "tool_use"), None)
+    # The schema requires every key, so an unreadable report comes back all-null; drop those so it stays falsy
+    return {k: v for k, v in block.input.items() if v is not None} if block else {}
+
+@st.cache_data(show_spinner=False, ttl=3600)
+def _extract_values_cached(text: str, _api_key: str) -> Dict:
+    """Claude extraction call, memoized on the report text (exceptions are not cached)"""
+    client = get_client(_api_key)
+    
+    prompt = f"""Extract all arterial blood gas (ABG) values from this report. 
+    Look for: pH, pCO2, pO2, HCO3/bicarbonate, base excess, Na, Cl, K, albumin.
+    
+    Report text:
+    {text}
+    
+    Use null for missing values.
+    Note: pCO2 and pO2 should be in kPa (not mmHg). If values are in mmHg, convert them (divide by 7.5)."""
+    
+    message = client.messages.create(
+        model=EXTRACTION_MODEL,
+        max_tokens=EXTRACTION_MAX_TOKENS,
+        tools=EXTRACTION_TOOLS,
+        tool_choice=EXTRACTION_TOOL_CHOICE,
+        messages=[{"role": "user", "content": prompt}]
+    )
+    
+    # A tool call cut off by the tight cap is missing values; raise so it isn't cached
+    if message.stop_reason == "max_tokens":
+        raise RuntimeError("The value extraction was cut off before it finished. Please try again.")
+    
+    return tool_input(message)
+
+@st.cache_data(show_spinner=False, ttl=3600)
+def _extract_and_analyze_cached(_image_b64: str, media_type: str, image_digest: str, clinical_info: str, _api_key: str) -> Tuple[Dict, str]:
+    """Single Claude vision call that reads the ABG values and writes the analysis, memoized on the upload's SHA-1"""
+    client = get_client(_api_key)
+    
+    message = client.messages.create(
+        model=ANALYSIS_MODEL,
+        max_tokens=UPLOAD_ANALYSIS_MAX_TOKENS,
+        tools=UPLOAD_ANALYSIS_TOOLS,
+        tool_choice=UPLOAD_ANALYSIS_TOOL_CHOICE,
+        messages=[{
+            "role": "user",
+            "content": [
+                {"type": "text", "text": ANALYSIS_INSTRUCTIONS, "cache_control": {"type": "ephemeral"}},
+                {
+                    "type": "image",
+                    "source": {
+                        "type": "base64",
+                        "media_type": media_type,
+                        "data": _image_b64
+                    }
+                },
+                {
+                    "type": "text",
+                    "text": f"""The ABG is in the attached report. Read its values: pH, pCO2, pO2, HCO3, base_excess, Na, Cl, K, albumin.
+Use null for missing values. Ensure pCO2 and pO2 are in kPa (convert from mmHg if needed by dividing by 7.5).
+Record the values and the full analysis with the record_abg_analysis tool.
+
+Clinical Information:
+{clinical_info if clinical_info else "Not provided"}"""
+                }
+            ]
+        }]
+    )
+    
+    # A truncated tool call loses values or cuts the analysis short; raise so it isn't cached
+    if message.stop_reason == "max_tokens":
+        raise RuntimeError("The analysis was cut off before it finished. Please try again.")
+    
+    values = tool_input(message)
+    analysis = values.pop("analysis", "")
+    return values, analysis
+
+def extract_values_from_text(text: str, api_key: str) -> Dict:
+    """Use Claude API to extract ABG values from text/image"""
+    try:
+        return _extract_values_cached(text, api_key)
+    except Exception as e:
+        st.error(f"Error extracting values: {str(e)}")
+        return {}
+
+def analyze_abg(values: Dict, clinical_info: str, api_key: str) -> Optional[str]:
+    """Use Claude API to perform step-by-step ABG analysis, streaming it into the page"""
+    try:
+        client = get_client(api_key)
         
-        return message.content[0].text
+        abg_details = f"""ABG Values:
+{dumps_pretty(values)}
+
+Clinical Information:
+{clinical_info if clinical_info else "Not provided"}"""
+
+        with client.messages.stream(
+            model=ANALYSIS_MODEL,
+            max_tokens=ANALYSIS_MAX_TOKENS,
+            messages=[{
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": ANALYSIS_INSTRUCTIONS, "cache_control": {"type": "ephemeral"}},
+                    {"type": "text", "text": abg_details}
+                ]
+            }]
+        ) as stream:
+            return st.write_stream(stream.text_stream)
     except Exception as e:
-        return f"Error during analysis: {str(e)}"
+        st.error(f"Error during analysis: {str(e)}")
+        return None
+
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=32)
+def build_report(values: tuple, analysis: str) -> str:
+    """Assemble the downloadable plain-text report once per values/analysis pair"""
+    return f"ABG ANALYSIS REPORT\n\n{'='*50}\n\nABG VALUES:\n{dumps_pretty(dict(values))}\n\n{'='*50}\n\nANALYSIS:\n{analysis}"
+
+@st.fragment
+def render_analysis_tab(api_key: str):
+    """Analysis tab, isolated so its widgets only rerun this fragment"""
+    st.header("Step-by-Step Analysis")
+    
+    if not st.session_state.abg_values:
+        st.info("👈 Please input ABG values in the 'Input Data' tab first.")
+    elif st.session_state.analysis_complete:
+        clinical_info = st.session_state.get('clinical_info', '')
+        
+        st.markdown('<div class="result-box">', unsafe_allow_html=True)
+        # Run the analysis once; later reruns (downloads, tab switches) reuse the stored text
+        if 'analysis_text' in st.session_state:
+            st.markdown(st.session_state.analysis_text)
+        else:
+            with st.spinner("🔬 Performing detailed analysis..."):
+                # analyze_abg renders the analysis as it streams in
+                analysis = analyze_abg(st.session_state.abg_values, clinical_info, api_key)
+            if analysis is not None:
+                st.session_state.analysis_text = analysis
+        st.markdown('</div>', unsafe_allow_html=True)
+        
+        analysis = st.session_state.get('analysis_text')
+        if analysis:
+            # Download button for analysis
+            st.download_button(
+                label="📥 Download Analysis Report",
+                data=build_report(tuple(st.session_state.abg_values.items()), analysis),
+                file_name="abg_analysis_report.txt",
+                mime="text/plain"
+            )
+        
+        if st.button("🔄 New Analysis"):
+            st.session_state.analysis_complete = False
+            st.session_state.abg_values = {}
+            st.session_state.pop('analysis_text', None)
+            st.rerun()
+    else:
+        st.info("Click 'Analyze ABG' in the Input Data tab to begin analysis.")
+
+def inject_css():
+    """Apply the app's custom CSS"""
+    st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
+
+def render_sidebar_reference():
+    """Static reference panel shown under the API key input"""
+    st.markdown("---")
+    st.header("📚 Normal Ranges")
+    st.markdown("""
+    - **pH:** 7.35 - 7.45
+    - **pCO₂:** 4.5 - 6.0 kPa
+    - **HCO₃⁻:** 22 - 28 mmol/L
+    - **pO₂:** 11 - 13 kPa
+    - **Base Excess:** -2 to +2 mmol/L
+    - **Anion Gap:** 8 - 16 mmol/L
+    - **Na⁺:** 135 - 145 mmol/L
+    - **Cl⁻:** 98 - 107 mmol/L
+    """)
+    
+    st.markdown("---")
+    st.markdown("### 📖 About")
+    st.info("This tool helps medical trainees learn ABG interpretation using a structured 5-step approach.")
+
+def render_learning_tab():
+    """Static Learning Resources tab content"""
+    st.header("📚 Learning Resources")
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.markdown("### 🎯 5-Step Approach")
+        st.markdown("""
+        1. **pH Assessment** - Acidaemia vs Alkalaemia
+        2. **Primary Disturbance** - Respiratory vs Metabolic
+        3. **Anion Gap** - Calculate if metabolic acidosis
+        4. **Compensation** - Appropriate or mixed disorder?
+        5. **Oxygenation** - A-a gradient assessment
+        """)
+        
+        st.markdown("### 🧮 Key Formulas")
+        st.markdown("""
+        **Anion Gap:**
+        ```
+        AG = Na⁺ - (Cl⁻ + HCO₃⁻)
+        Normal: 8-16 mmol/L
+        ```
+        
+        **Corrected AG (for albumin):**
+        ```
+        Corrected AG = AG + [(40 - albumin)/10] × 2.5
+        ```
+        
+        **A-a Gradient:**
+        ```
+        A-a = PAO₂ - PaO₂
+        PAO₂ = 20 - (PaCO₂ × 1.2)
+        Normal: 2-4 kPa
+        ```
+        """)
+    
+    with col2:
+        st.markdown("### 🔍 Common Causes")
+        
+        with st.expander("Respiratory Acidosis (↑pCO₂)"):
+            st.markdown("""
+            - COPD exacerbation
+            - Pneumonia
+            - Respiratory muscle weakness
+            - Opioid overdose
+            - Obesity hypoventilation
+            """)
+        
+        with st.expander("Metabolic Acidosis (↓HCO₃⁻)"):
+            st.markdown("""
+            **High Anion Gap:**
+            - Diabetic ketoacidosis
+            - Lactic acidosis
+            - Renal failure
+            - Toxins (methanol, ethylene glycol)
+            
+            **Normal Anion Gap:**
+            - Diarrhea
+            - Renal tubular acidosis
+            - Acetazolamide use
+            """)
+        
+        with st.expander("Respiratory Alkalosis (↓pCO₂)"):
+            st.markdown("""
+            - Anxiety/hyperventilation
+            - Pulmonary embolism
+            - Pregnancy
+            - Salicylate poisoning (early)
+            - High altitude
+            """)
+        
+        with st.expander("Metabolic Alkalosis (↑HCO₃⁻)"):
+            st.markdown("""
+            - Vomiting/NG suction
+            - Diuretic use
+            - Hyperaldosteronism
+            - Hypokalaemia
+            """)
+    
+    st.markdown("---")
+    st.markdown("### 💡 Tips for Interpretation")
+    st.info("""
+    - Always consider the clinical context
+    - Look for mixed disorders when compensation seems off
+    - Remember: compensation never overcorrects
+    - Calculate anion gap for ALL metabolic acidosis cases
+    - Don't forget to correct anion gap for albumin in chronic illness
+    """)
 
 def main():
+    inject_css()
     st.markdown('<h1 class="main-header">🩺 ABG Interpreter</h1>', unsafe_allow_html=True)
     st.markdown('<p style="text-align: center; color: #666;">Step-by-Step Arterial Blood Gas Analysis Training Tool</p>', unsafe_allow_html=True)
     
@@ -183,22 +483,7 @@ def main():
         st.header("⚙️ Configuration")
         api_key = st.text_input("Claude API Key", type="password", help="Enter your Anthropic API key")
         
-        st.markdown("---")
-        st.header("📚 Normal Ranges")
-        st.markdown("""
-        - **pH:** 7.35 - 7.45
-        - **pCO₂:** 4.5 - 6.0 kPa
-        - **HCO₃⁻:** 22 - 28 mmol/L
-        - **pO₂:** 11 - 13 kPa
-        - **Base Excess:** -2 to +2 mmol/L
-        - **Anion Gap:** 8 - 16 mmol/L
-        - **Na⁺:** 135 - 145 mmol/L
-        - **Cl⁻:** 98 - 107 mmol/L
-        """)
-        
-        st.markdown("---")
-        st.markdown("### 📖 About")
-        st.info("This tool helps medical trainees learn ABG interpretation using a structured 5-step approach.")
+        render_sidebar_reference()
     
     if not api_key:
         st.warning("⚠️ Please enter your Claude API key in the sidebar to begin.")
@@ -217,6 +502,16 @@ def main():
     with tab1:
         st.header("Step 1: Input ABG Data")
         
+        # Clinical information comes first so the single upload call can include it in the analysis
+        st.markdown("### 🏥 Clinical Information (Optional)")
+        clinical_info = st.text_area(
+            "Patient history, symptoms, medications, etc.",
+            placeholder="e.g., 65-year-old male with COPD, presenting with shortness of breath...",
+            height=100,
+            key="clinical_info_input"
+        )
+        st.markdown("---")
+        
         # Upload method selection
         input_method = st.radio("Choose input method:", 
                                ["Upload ABG Report (Image/PDF)", "Manual Entry"],
@@ -230,7 +525,8 @@ def main():
             )
             
             if uploaded_file:
-                if uploaded_file.type == "application/pdf":
+                file_bytes = uploaded_file.getvalue()
+                if sniff_mime(file_bytes, uploaded_file.type) == "application/pdf":
                     st.info("📄 PDF uploaded. Please manually extract text or use OCR tool.")
                     text_input = st.text_area("Paste extracted text from PDF:", height=200)
                     if st.button("Extract Values from Text"):
@@ -238,53 +534,44 @@ def main():
                             extracted = extract_values_from_text(text_input, api_key)
                             if extracted:
                                 st.session_state.abg_values = extracted
+                                st.session_state.pop('analysis_text', None)
+                                st.session_state.analysis_complete = False
                                 st.success("✅ Values extracted successfully!")
+                            else:
+                                st.error("Could not extract values. Please try manual entry.")
                 else:
-                    st.image(uploaded_file, caption="Uploaded ABG Report", use_container_width=True)
-                    
-                    # Convert image to base64
-                    bytes_data = uploaded_file.getvalue()
-                    base64_image = base64.b64encode(bytes_data).decode()
-                    
-                    if st.button("Extract Values from Image"):
-                        with st.spinner("Analyzing image..."):
-                            # Use Claude's vision capability
-                            try:
-                                client = anthropic.Anthropic(api_key=api_key)
-                                message = client.messages.create(
-                                    model="claude-sonnet-4-20250514",
-                                    max_tokens=1000,
-                                    messages=[{
-                                        "role": "user",
-                                        "content": [
-                                            {
-                                                "type": "image",
-                                                "source": {
-                                                    "type": "base64",
-                                                    "media_type": uploaded_file.type,
-                                                    "data": base64_image
-                                                }
-                                            },
-                                            {
-                                                "type": "text",
-                                                "text": """Extract ABG values from this report. Return ONLY a JSON object with: pH, pCO2, pO2, HCO3, base_excess, Na, Cl, K, albumin. 
-                                                Use null for missing values. Ensure pCO2 and pO2 are in kPa (convert from mmHg if needed by dividing by 7.5).
-                                                Example: {"pH": 7.35, "pCO2": 5.5, "HCO3": 24, "base_excess": -1, "Na": 140, "Cl": 102}"""
-                                            }
-                                        ]
-                                    }]
-                                )
-                                
-                                response_text = message.content[0].text
-                                json_match = re.search(r'\{[^}]+\}', response_text, re.DOTALL)
-                                if json_match:
-                                    extracted = json.loads(json_match.group())
-                                    st.session_state.abg_values = extracted
-                                    st.success("✅ Values extracted successfully!")
-                                else:
-                                    st.error("Could not extract values. Please try manual entry.")
-                            except Exception as e:
-                                st.error(f"Error: {str(e)}")
+                    # Downscale and convert image to base64 (cached on the upload's bytes);
+                    # Pillow reports corrupt data during decode as OSError, SyntaxError or ValueError
+                    try:
+                        base64_image, media_type, image_digest = encode_image(file_bytes)
+                    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+                        st.error("Could not read this image. Please upload a valid PNG or JPEG, or use manual entry.")
+                    else:
+                        # Preview the decoded copy; st.image would raise on the raw bytes of an unreadable file
+                        st.image(base64.b64decode(base64_image), caption="Uploaded ABG Report", use_container_width=True)
+                        
+                        if st.button("Extract Values from Image"):
+                            with st.spinner("Analyzing image..."):
+                                # Use Claude's vision capability to extract and analyse in one round-trip
+                                try:
+                                    extracted, analysis = _extract_and_analyze_cached(
+                                        base64_image, media_type, image_digest, clinical_info, api_key
+                                    )
+                                    if extracted:
+                                        st.session_state.abg_values = extracted
+                                        st.session_state.clinical_info = clinical_info
+                                        if analysis:
+                                            st.session_state.analysis_text = analysis
+                                            st.session_state.analysis_complete = True
+                                            st.success("✅ Values extracted and analysed! See the Analysis tab.")
+                                        else:
+                                            st.session_state.pop('analysis_text', None)
+                                            st.session_state.analysis_complete = False
+                                            st.success("✅ Values extracted successfully!")
+                                    else:
+                                        st.error("Could not extract values. Please try manual entry.")
+                                except Exception as e:
+                                    st.error(f"Error: {str(e)}")
         
         else:  # Manual Entry
             st.markdown("### Enter ABG values manually:")
@@ -325,6 +612,8 @@ def main():
                     'Na': Na,
                     'Cl': Cl
                 }
+                st.session_state.pop('analysis_text', None)
+                st.session_state.analysis_complete = False
                 st.success("✅ Values saved!")
         
         # Display current values
@@ -332,150 +621,28 @@ def main():
             st.markdown("---")
             st.markdown("### 📋 Current ABG Values:")
             
+            items = list(st.session_state.abg_values.items())
             cols = st.columns(4)
-            for idx, (key, value) in enumerate(st.session_state.abg_values.items()):
+            for idx, (key, value) in enumerate(items):
                 if value is not None:
                     with cols[idx % 4]:
                         # Check if value is in normal range
-                        is_normal = True
-                        if key in NORMAL_RANGES and value is not None:
-                            min_val, max_val = NORMAL_RANGES[key]
-                            is_normal = min_val <= value <= max_val
-                        
-                        status = "✅" if is_normal else "⚠️"
-                        st.metric(f"{status} {key}", f"{value}")
-        
-        # Clinical information
-        st.markdown("---")
-        st.markdown("### 🏥 Clinical Information (Optional)")
-        clinical_info = st.text_area(
-            "Patient history, symptoms, medications, etc.",
-            placeholder="e.g., 65-year-old male with COPD, presenting with shortness of breath...",
-            height=100
-        )
+                        rng = NORMAL_RANGES.get(key)
+                        is_normal = rng is None or rng[0] <= value <= rng[1]
+                        st.metric(f"{'✅' if is_normal else '⚠️'} {key}", f"{value}")
         
         if st.session_state.abg_values and st.button("🔍 Analyze ABG", type="primary", use_container_width=True):
+            if clinical_info != st.session_state.get('clinical_info'):
+                st.session_state.pop('analysis_text', None)
             st.session_state.clinical_info = clinical_info
             st.session_state.analysis_complete = True
             st.success("✅ Ready for analysis! Go to the Analysis tab.")
     
     with tab2:
-        st.header("Step-by-Step Analysis")
-        
-        if not st.session_state.abg_values:
-            st.info("👈 Please input ABG values in the 'Input Data' tab first.")
-        elif st.session_state.analysis_complete:
-            with st.spinner("🔬 Performing detailed analysis..."):
-                clinical_info = st.session_state.get('clinical_info', '')
-                analysis = analyze_abg(st.session_state.abg_values, clinical_info, api_key)
-                
-                st.markdown('<div class="result-box">', unsafe_allow_html=True)
-                st.markdown(analysis)
-                st.markdown('</div>', unsafe_allow_html=True)
-                
-                # Download button for analysis
-                st.download_button(
-                    label="📥 Download Analysis Report",
-                    data=f"ABG ANALYSIS REPORT\n\n{'='*50}\n\nABG VALUES:\n{json.dumps(st.session_state.abg_values, indent=2)}\n\n{'='*50}\n\nANALYSIS:\n{analysis}",
-                    file_name="abg_analysis_report.txt",
-                    mime="text/plain"
-                )
-                
-                if st.button("🔄 New Analysis"):
-                    st.session_state.analysis_complete = False
-                    st.session_state.abg_values = {}
-                    st.rerun()
-        else:
-            st.info("Click 'Analyze ABG' in the Input Data tab to begin analysis.")
+        render_analysis_tab(api_key)
     
     with tab3:
-        st.header("📚 Learning Resources")
-        
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            st.markdown("### 🎯 5-Step Approach")
-            st.markdown("""
-            1. **pH Assessment** - Acidaemia vs Alkalaemia
-            2. **Primary Disturbance** - Respiratory vs Metabolic
-            3. **Anion Gap** - Calculate if metabolic acidosis
-            4. **Compensation** - Appropriate or mixed disorder?
-            5. **Oxygenation** - A-a gradient assessment
-            """)
-            
-            st.markdown("### 🧮 Key Formulas")
-            st.markdown("""
-            **Anion Gap:**
-            ```
-            AG = Na⁺ - (Cl⁻ + HCO₃⁻)
-            Normal: 8-16 mmol/L
-            ```
-            
-            **Corrected AG (for albumin):**
-            ```
-            Corrected AG = AG + [(40 - albumin)/10] × 2.5
-            ```
-            
-            **A-a Gradient:**
-            ```
-            A-a = PAO₂ - PaO₂
-            PAO₂ = 20 - (PaCO₂ × 1.2)
-            Normal: 2-4 kPa
-            ```
-            """)
-        
-        with col2:
-            st.markdown("### 🔍 Common Causes")
-            
-            with st.expander("Respiratory Acidosis (↑pCO₂)"):
-                st.markdown("""
-                - COPD exacerbation
-                - Pneumonia
-                - Respiratory muscle weakness
-                - Opioid overdose
-                - Obesity hypoventilation
-                """)
-            
-            with st.expander("Metabolic Acidosis (↓HCO₃⁻)"):
-                st.markdown("""
-                **High Anion Gap:**
-                - Diabetic ketoacidosis
-                - Lactic acidosis
-                - Renal failure
-                - Toxins (methanol, ethylene glycol)
-                
-                **Normal Anion Gap:**
-                - Diarrhea
-                - Renal tubular acidosis
-                - Acetazolamide use
-                """)
-            
-            with st.expander("Respiratory Alkalosis (↓pCO₂)"):
-                st.markdown("""
-                - Anxiety/hyperventilation
-                - Pulmonary embolism
-                - Pregnancy
-                - Salicylate poisoning (early)
-                - High altitude
-                """)
-            
-            with st.expander("Metabolic Alkalosis (↑HCO₃⁻)"):
-                st.markdown("""
-                - Vomiting/NG suction
-                - Diuretic use
-                - Hyperaldosteronism
-                - Hypokalaemia
-                """)
-        
-        st.markdown("---")
-        st.markdown("### 💡 Tips for Interpretation")
-        st.info("""
-        - Always consider the clinical context
-        - Look for mixed disorders when compensation seems off
-        - Remember: compensation never overcorrects
-        - Calculate anion gap for ALL metabolic acidosis cases
-        - Don't forget to correct anion gap for albumin in chronic illness
-        """)
+        render_learning_tab()
 
 if __name__ == "__main__":
     main()